@@ -4,46 +4,249 @@ from __future__ import annotations
 import sys
 import os
 import logging
+import hashlib
+import pickle
+import copy
 from typing import Any, List, Optional, Union, Tuple, Dict
 from enum import Enum
+from dataclasses import dataclass, field, InitVar
+from functools import cached_property, lru_cache
 
-from gerber2ems.constants import CONFIG_FORMAT_VERSION, UNIT
+import fastjsonschema
+
+from gerber2ems.constants import CONFIG_FORMAT_VERSION, CONFIG_FORMAT_VERSION_PARTS, UNIT
 
 logger = logging.getLogger(__name__)
 
+def _object(properties: Dict[str, Any], required: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """Build object schema which defaults to the defaults of its properties."""
+    schema = {
+        "type": "object",
+        "properties": properties,
+        "default": {name: prop["default"] for name, prop in properties.items() if "default" in prop},
+    }
+    if required:
+        schema["required"] = list(required)
+    return schema
+
+def _field(kind: str, default: Any = None) -> Dict[str, Any]:
+    """Build field schema with optional default value."""
+    schema: Dict[str, Any] = {"type": kind}
+    if default is not None:
+        schema["default"] = default
+    return schema
+
+PORT_SCHEMA = _object(
+    {
+        "name": _field("string", "Unnamed"),
+        "width": _field("number"),
+        "length": _field("number", 1000),
+        "impedance": _field("number", 50),
+        "layer": _field("integer"),
+        "plane": _field("integer"),
+        "dB_margin": _field("number", -15),
+        "excite": _field("boolean", False),
+    },
+    required=("width", "layer", "plane"),
+)
+
+DIFFERENTIAL_PAIR_SCHEMA = _object(
+    {
+        "name": _field("string"),
+        "start_p": _field("integer"),
+        "stop_p": _field("integer"),
+        "start_n": _field("integer"),
+        "stop_n": _field("integer"),
+    },
+    required=("start_p", "stop_p", "start_n", "stop_n"),
+)
+
+TRACE_SCHEMA = _object(
+    {
+        "name": _field("string"),
+        "start": _field("integer"),
+        "stop": _field("integer"),
+    },
+    required=("start", "stop"),
+)
+
+LAYER_SCHEMA = _object(
+    {
+        "name": _field("string", "Unnamed"),
+        "type": {"enum": ["core", "prepreg", "copper"]},
+        "file": _field("string", ""),
+        "thickness": _field("number", 0),
+        "export_field": _field("boolean", False),
+        "z_mesh_count": _field("integer", -1),
+        "epsilon": _field("number"),
+        "priority": _field("integer"),
+    },
+    required=("type",),
+)
+# Substrate layers need a dielectric constant
+LAYER_SCHEMA["if"] = {"properties": {"type": {"enum": ["core", "prepreg"]}}}
+LAYER_SCHEMA["then"] = {"required": ["epsilon"]}
+
+CONFIG_SCHEMA = _object(
+    {
+        "format_version": _field("string"),
+        "frequency": _object({
+            "start": _field("number", 500e3),
+            "stop": _field("number", 10e6),
+        }),
+        "max_steps": _field("number"),
+        "mesh": _object({
+            "xy": _field("number", 50),
+            "inter_layers": _field("integer", 5),
+            "smoothing_ratio": _field("number", 2),
+            "margin": _object({
+                "xy": _field("number", 200),
+                "z": _field("number", 200),
+            }),
+        }),
+        "margin": _object({
+            "xy": _field("number", 3000),
+            "z": _field("number", 3000),
+        }),
+        "via": _object({
+            "plating_thickness": _field("number", 50),
+            "filling_epsilon": _field("number", 1),
+        }),
+        "offset": _object({
+            "x": _field("number", 0),
+            "y": _field("number", 0),
+        }),
+        "nanomesh": _object({
+            "threshold": _field("integer", 127),
+            "precision": _field("number", 5),
+            "max_edge_distance": _field("number", 10),
+            "minimum_angle": _field("integer", 20),
+            "max_triangle_area": _field("integer", 100),
+        }),
+        "ports": {"type": "array", "items": PORT_SCHEMA},
+        "differential_pairs": {"type": "array", "items": DIFFERENTIAL_PAIR_SCHEMA, "default": []},
+        "traces": {"type": "array", "items": TRACE_SCHEMA, "default": []},
+        "layers": {"type": "array", "items": LAYER_SCHEMA, "default": []},
+    },
+    required=("format_version", "max_steps", "ports"),
+)
+
+# Compiled once at import, fills in defaults while validating
+_VALIDATE = fastjsonschema.compile(CONFIG_SCHEMA, use_default=True)
+
+# Numeric fields of Config as (attribute, path in validated json)
+_INT_FIELDS = (
+    ("start_frequency", ("frequency", "start")),
+    ("stop_frequency", ("frequency", "stop")),
+    ("max_steps", ("max_steps",)),
+    ("pcb_mesh_xy", ("mesh", "xy")),
+    ("inter_copper_layers", ("mesh", "inter_layers")),
+    ("margin_xy", ("margin", "xy")),
+    ("margin_z", ("margin", "z")),
+    ("margin_mesh_xy", ("mesh", "margin", "xy")),
+    ("margin_mesh_z", ("mesh", "margin", "z")),
+    ("via_plating", ("via", "plating_thickness")),
+)
+_FLOAT_FIELDS = (
+    ("smoothing_ratio", ("mesh", "smoothing_ratio")),
+    ("via_filling_epsilon", ("via", "filling_epsilon")),
+    ("x_offset", ("offset", "x")),
+    ("y_offset", ("offset", "y")),
+)
+
+def _validate(json: Any) -> Any:
+    """Validate config and fill in defaults.
+
+    Optional fields with incorrect type are replaced by their defaults like missing ones.
+    """
+    while True:
+        try:
+            return _VALIDATE(json)
+        except fastjsonschema.JsonSchemaException as error:
+            # Validator reports array indices as strings
+            path = tuple(int(name) if name.isdigit() else name for name in error.path[1:])
+            if error.rule != "type" or not path or isinstance(path[-1], int) or _is_required(path):
+                logger.error("Config is invalid: %s", error.message)
+                sys.exit(1)
+            parent = _get_path(json, path[:-1])
+            if "default" not in error.definition:
+                # Field is removed so the default is applied when its config entry is created
+                logger.warning("Field %s found in config has incorrect type %s. Using default", list(path), type(error.value))
+                del parent[path[-1]]
+                continue
+            default = copy.deepcopy(error.definition["default"])
+            logger.warning(
+                "Field %s found in config has incorrect type %s. Using default: %s",
+                list(path),
+                type(error.value),
+                str(default),
+            )
+            parent[path[-1]] = default
+
+def _is_required(path: Tuple[Union[str, int], ...]) -> bool:
+    """Check if schema requires field under path in config."""
+    schema = CONFIG_SCHEMA
+    for name in path[:-1]:
+        schema = schema["items"] if isinstance(name, int) else schema["properties"][name]
+    return path[-1] in schema.get("required", ())
+
+def _get_path(json: Any, path: Tuple[Union[str, int], ...]) -> Any:
+    """Return value found under path in validated json object."""
+    for name in path:
+        json = json[name]
+    return json
+
 class MaterialPriorityConfig:
     def __init__(self) -> None:
         self.simulation_port = 200
         self.via_filling = 101
         self.via_metal = 100
 
+@dataclass(slots=True)
 class PortConfig:
     """Class representing and parsing port config."""
 
-    def __init__(self, config: Any) -> None:
-        """Initialize PortConfig based on passed json object."""
-        self.name: str = get(config, ["name"], str, "Unnamed")
-        self.position: Union[Tuple[float, float], None] = None
-        self.direction: Union[float, None] = None
-        self.width = get(config, ["width"], (float, int))
-        self.length = get(config, ["length"], (float, int), 1000)
-        self.impedance = get(config, ["impedance"], (float, int), 50)
-        self.layer = get(config, ["layer"], int)
-        self.plane = get(config, ["plane"], int)
-        self.dB_margin = get(config, ["dB_margin"], (float, int), -15)
-        self.excite = get(config, ["excite"], bool, False)
+    width: float
+    layer: int
+    plane: int
+    name: str = "Unnamed"
+    length: float = 1000
+    impedance: float = 50
+    dB_margin: float = -15
+    excite: bool = False
+    position: Union[Tuple[float, float], None] = None
+    direction: Union[float, None] = None
 
+    @classmethod
+    def from_config(cls, config: Any) -> PortConfig:
+        """Create PortConfig based on passed json object."""
+        return cls(
+            width=config["width"],
+            layer=int(config["layer"]),
+            plane=int(config["plane"]),
+            name=config["name"],
+            length=config["length"],
+            impedance=config["impedance"],
+            dB_margin=config["dB_margin"],
+            excite=config["excite"],
+        )
+
+@dataclass(slots=True)
 class DifferentialPairConfig:
     """Class representing and parsing differential pair config."""
 
-    def __init__(self, config: Any, port_count: int) -> None:
-        """Initialize DifferentialPairConfig based on passed json object."""
-        self.start_p = get(config, ["start_p"], int)
-        self.stop_p = get(config, ["stop_p"], int)
-        self.start_n = get(config, ["start_n"], int)
-        self.stop_n = get(config, ["stop_n"], int)
-        self.name = get(config, ["name"], str, f"{self.start_p}{self.stop_p}{self.start_n}{self.stop_n}")
-        self.correct = True
+    start_p: int
+    stop_p: int
+    start_n: int
+    stop_n: int
+    port_count: InitVar[int]
+    name: Union[str, None] = None
+    correct: bool = field(default=True, init=False)
+
+    def __post_init__(self, port_count: int) -> None:
+        """Fill in default name and check that used ports exist."""
+        if self.name is None:
+            self.name = f"{self.start_p}{self.stop_p}{self.start_n}{self.stop_n}"
 
         if self.start_p >= port_count:
             logger.warning(
@@ -66,16 +269,33 @@ class DifferentialPairConfig:
             )
             self.correct = False
 
+    @classmethod
+    def from_config(cls, config: Any, port_count: int) -> DifferentialPairConfig:
+        """Create DifferentialPairConfig based on passed json object."""
+        return cls(
+            start_p=int(config["start_p"]),
+            stop_p=int(config["stop_p"]),
+            start_n=int(config["start_n"]),
+            stop_n=int(config["stop_n"]),
+            port_count=port_count,
+            name=config.get("name"),
+        )
+
 
+@dataclass(slots=True)
 class TraceConfig:
-    """Class representing and parsing differential pair config."""
+    """Class representing and parsing trace config."""
+
+    start: int
+    stop: int
+    port_count: InitVar[int]
+    name: Union[str, None] = None
+    correct: bool = field(default=True, init=False)
 
-    def __init__(self, config: Any, port_count: int) -> None:
-        """Initialize DifferentialPairConfig based on passed json object."""
-        self.start = get(config, ["start"], int)
-        self.stop = get(config, ["stop"], int)
-        self.name = get(config, ["name"], str, f"{self.start}{self.stop}")
-        self.correct = True
+    def __post_init__(self, port_count: int) -> None:
+        """Fill in default name and check that used ports exist."""
+        if self.name is None:
+            self.name = f"{self.start}{self.stop}"
 
         if self.start >= port_count:
             logger.warning(f"Trace {self.name} is defined to use not existing port number {self.start} as start")
@@ -84,37 +304,58 @@ class TraceConfig:
             logger.warning(f"Trace {self.name} is defined to use not existing port number {self.stop} as stop")
             self.correct = False
 
+    @classmethod
+    def from_config(cls, config: Any, port_count: int) -> TraceConfig:
+        """Create TraceConfig based on passed json object."""
+        return cls(
+            start=int(config["start"]),
+            stop=int(config["stop"]),
+            port_count=port_count,
+            name=config.get("name"),
+        )
+
 
+@dataclass(slots=True)
 class LayerConfig:
     """Class representing and parsing layer config."""
 
-    def __init__(self, config: Any) -> None:
-        """Initialize LayerConfig based on passed json object."""
-        self.name = get(config, ["name"], str, "Unnamed")
-        self.kind = self.parse_kind(get(config, ["type"], str))
-        self.file = get(config, ["file"], str, "")
-        if self.file == "":
-            self.file = None
-        self.thickness = get(config, ["thickness"], (float, int), 0)
-        self.thickness = self.thickness / 1000 / UNIT
-        self.thickness = int(self.thickness) # must be unit number of microns
+    kind: LayerKind
+    name: str = "Unnamed"
+    file: Union[str, None] = None
+    thickness: int = 0 # must be unit number of microns
+    export_field: bool = False
+    z_mesh_count: Union[int, None] = None
+    epsilon: Union[float, None] = None
+    priority: Union[int, None] = None
+
+    def __post_init__(self) -> None:
+        """Apply kind dependent adjustments and defaults."""
         if self.kind == LayerKind.METAL and self.thickness % 2 != 0:
             # need thickness of metal layers to be even since we need to divide the thickness in 2 when embedding it
             logger.warning(f"Metal layer name={self.name} has thickness in microns that isn't odd, will be changed to even")
             self.thickness += 1
-        self.export_field = get(config, ["export_field"], bool, False)
-        self.z_mesh_count = get(config, ["z_mesh_count"], int, -1)
-        if self.z_mesh_count == -1:
-            self.z_mesh_count = None
-        if self.kind == LayerKind.SUBSTRATE:
-            self.epsilon = get(config, ["epsilon"], (float, int))
-            self.priority = get(config, ["priority"], int, 50)
-        elif self.kind == LayerKind.METAL:
-            self.priority = get(config, ["priority"], int, 51)
+        if self.priority is None:
+            self.priority = 50 if self.kind == LayerKind.SUBSTRATE else 51
 
         if self.kind == LayerKind.METAL and self.file == None:
             logger.error(f"Metal layer name={self.name} has no Gerber file associated with it")
 
+    @classmethod
+    def from_config(cls, config: Any) -> LayerConfig:
+        """Create LayerConfig based on passed json object."""
+        kind = cls.parse_kind(config["type"])
+        z_mesh_count = int(config["z_mesh_count"])
+        return cls(
+            kind=kind,
+            name=config["name"],
+            file=config["file"] or None,
+            thickness=int(config["thickness"] / 1000 / UNIT),
+            export_field=config["export_field"],
+            z_mesh_count=None if z_mesh_count == -1 else z_mesh_count,
+            epsilon=config["epsilon"] if kind == LayerKind.SUBSTRATE else None,
+            priority=config.get("priority"),
+        )
+
     def __repr__(self):
         """Get human-readable string describing layer."""
         return f"Layer kind:{self.kind} thickness: {self.thickness}"
@@ -122,62 +363,29 @@ class LayerConfig:
     @staticmethod
     def parse_kind(kind: str):
         """Parse type name to enum."""
-        if kind in ["core", "prepreg"]:
-            return LayerKind.SUBSTRATE
-        if kind == "copper":
-            return LayerKind.METAL
-        raise Exception(f"Unknown layer kind: {kind}")
+        try:
+            return _LAYER_KINDS[kind]
+        except KeyError:
+            raise Exception(f"Unknown layer kind: {kind}") from None
 
 class LayerKind(Enum):
     """Enum describing layer type."""
     SUBSTRATE = 1
     METAL = 2
 
-def get(
-    config: Any,
-    path: List[Union[str, int]],
-    kind: Union[type, Tuple[type, ...]],
-    default=None,
-):
-    """Gracefully look for value in object."""
-    for name in path:
-        if isinstance(config, Dict) and name in config:
-            config = config[name]
-        elif isinstance(name, int) and isinstance(config, List) and name < len(config):
-            config = config[name]
-        elif default is None:
-            logger.error("No field %s found in config", path)
-            sys.exit(1)
-        else:
-            logger.warning("No field %s found in config. Using default: %s", path, str(default))
-            return default
-    if isinstance(config, kind):
-        return config
-    if default is None:
-        logger.error(
-            "Field %s found in config has incorrect type %s (correct is %s)",
-            path,
-            type(config),
-            kind,
-        )
-        sys.exit(1)
-    else:
-        logger.warning(
-            "Field %s found in config has incorrect type %s (correct is %s). Using default: %s",
-            path,
-            type(config),
-            kind,
-            str(default),
-        )
-        return default
+_LAYER_KINDS = {
+    "core": LayerKind.SUBSTRATE,
+    "prepreg": LayerKind.SUBSTRATE,
+    "copper": LayerKind.METAL,
+}
 
 class NanomeshConfig:
     def __init__(self, json: Any):
-        self.threshold = int(get(json, ["nanomesh", "threshold"], (int,), 127))
-        self.precision = float(get(json, ["nanomesh", "precision"], (int, float), 5))
-        self.max_edge_distance = float(get(json, ["nanomesh", "max_edge_distance"], (int, float), 10))
-        self.minimum_angle = int(get(json, ["nanomesh", "minimum_angle"], (int,), 20))
-        self.max_triangle_area = int(get(json, ["nanomesh", "max_triangle_area"], (int,), 100))
+        self.threshold = int(json["nanomesh"]["threshold"])
+        self.precision = float(json["nanomesh"]["precision"])
+        self.max_edge_distance = float(json["nanomesh"]["max_edge_distance"])
+        self.minimum_angle = int(json["nanomesh"]["minimum_angle"])
+        self.max_triangle_area = int(json["nanomesh"]["max_triangle_area"])
 
 class DirectoryConfig:
     def __init__(self, input_dir: str, output_dir: str):
@@ -188,6 +396,27 @@ class DirectoryConfig:
         self.simulation_dir = os.path.join(output_dir, "simulation")
         self.results_dir = os.path.join(output_dir, "results")
         self.graphs_dir = os.path.join(output_dir, "graphs")
+        self.config_cache_dir = os.path.join(output_dir, ".config_cache")
+
+@lru_cache(maxsize=None)
+def _get_source_digest() -> bytes:
+    """Return digest of sources that define how config is parsed, so cache is invalidated when they change."""
+    digest = hashlib.blake2b()
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in ("config.py", "constants.py"):
+        with open(os.path.join(module_dir, name), "rb") as file:
+            digest.update(file.read())
+    return digest.digest()
+
+class _WarningCollector(logging.Handler):
+    """Log handler collecting warnings (and errors) so they can be replayed."""
+
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.records: List[Tuple[int, str]] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append((record.levelno, record.getMessage()))
 
 class Config:
     """Class representing and parsing config."""
@@ -203,6 +432,57 @@ class Config:
         logger.error("Config hasn't been instantiated. Exiting")
         sys.exit(1)
 
+    @classmethod
+    def set(cls, config: Config) -> None:
+        """Use already built config as the instance (e.g. in worker processes)."""
+        cls._instance = config
+
+    @staticmethod
+    def _get_cache_path(content: bytes, dirs: DirectoryConfig) -> str:
+        """Return path of cached config built from given config file content."""
+        key = hashlib.blake2b(content + CONFIG_FORMAT_VERSION.encode() + _get_source_digest()).hexdigest()
+        return os.path.join(dirs.config_cache_dir, f"{key}.pkl")
+
+    @classmethod
+    def load_cached(cls, content: bytes, args: Any) -> Optional[Config]:
+        """Instantiate config from cache if config file content was already parsed."""
+        dirs = DirectoryConfig(args.input, args.output)
+        path = cls._get_cache_path(content, dirs)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "rb") as file:
+                config = pickle.load(file)
+        except Exception as error:
+            logger.warning("Failed to load cached config %s: %s", path, error)
+            return None
+        if not isinstance(config, cls):
+            logger.warning("Cached config %s is invalid. Ignoring", path)
+            return None
+
+        logger.info("Using cached config %s", path)
+        for level, message in config._parse_warnings:
+            logger.log(level, message)
+        config.arguments = args
+        config.dirs = dirs
+        cls.set(config)
+        return config
+
+    def save_cache(self, content: bytes) -> None:
+        """Save config to cache so it can be reused if config file content doesn't change."""
+        path = self._get_cache_path(content, self.dirs)
+        os.makedirs(self.dirs.config_cache_dir, exist_ok=True)
+        # Only the current config is kept, older entries would just accumulate.
+        # Cache directory is used only by this code so every .pkl file in it is one of its entries
+        for name in os.listdir(self.dirs.config_cache_dir):
+            old_path = os.path.join(self.dirs.config_cache_dir, name)
+            if old_path != path and name.endswith(".pkl"):
+                os.remove(old_path)
+        logger.debug("Saving config to cache %s", path)
+        with open(path, "wb") as file:
+            pickle.dump(self, file)
+
     def __init__(self, json: Any, args: Any) -> None:
         """Initialize Config based on passed json object."""
         if self.__class__._instance is not None:
@@ -210,12 +490,17 @@ class Config:
             return
 
         logger.info("Parsing config")
-        version = get(json, ["format_version"], str)
-        if (
-            version is None
-            or not version.split(".")[0] == CONFIG_FORMAT_VERSION.split(".", maxsplit=1)[0]
-            or version.split(".")[1] < CONFIG_FORMAT_VERSION.split(".", maxsplit=1)[1]
-        ):
+        # Warnings are kept with the cached config so they are shown on every run
+        collector = _WarningCollector()
+        logger.addHandler(collector)
+        json = _validate(json)
+
+        version = json["format_version"]
+        try:
+            major, minor = map(int, version.split(".")[:2])
+        except ValueError:
+            major, minor = -1, -1
+        if major != CONFIG_FORMAT_VERSION_PARTS[0] or (major, minor) < CONFIG_FORMAT_VERSION_PARTS[:2]:
             logger.error(
                 "Config format (%s) is not supported (supported: %s)",
                 version,
@@ -223,73 +508,73 @@ class Config:
             )
             sys.exit()
 
-        self.start_frequency = int(get(json, ["frequency", "start"], (float, int), 500e3))
-        self.stop_frequency = int(get(json, ["frequency", "stop"], (float, int), 10e6))
-        self.max_steps = int(get(json, ["max_steps"], (float, int), None))
+        for name, path in _INT_FIELDS:
+            setattr(self, name, int(_get_path(json, path)))
+        for name, path in _FLOAT_FIELDS:
+            setattr(self, name, float(_get_path(json, path)))
         self.pcb_width: Union[int, None] = None
         self.pcb_height: Union[int, None] = None
-        self.pcb_mesh_xy = int(get(json, ["mesh", "xy"], (float, int), 50))
-        self.inter_copper_layers = int(get(json, ["mesh", "inter_layers"], int, 5))
-        self.margin_xy = int(get(json, ["margin", "xy"], (float, int), 3000))
-        self.margin_z = int(get(json, ["margin", "z"], (float, int), 3000))
-        self.margin_mesh_xy = int(get(json, ["mesh", "margin", "xy"], (float, int), 200))
-        self.margin_mesh_z = int(get(json, ["mesh", "margin", "z"], (float, int), 200))
-        self.smoothing_ratio = float(get(json, ["mesh", "smoothing_ratio"], (float, int), 2))
-        self.via_plating = int(get(json, ["via", "plating_thickness"], (int, float), 50))
-        self.via_filling_epsilon = float(get(json, ["via", "filling_epsilon"], (int, float), 1))
-        self.x_offset = float(get(json, ["offset", "x"], (int, float), 0))
-        self.y_offset = float(get(json, ["offset", "y"], (int, float), 0))
         self.nanomesh = NanomeshConfig(json)
 
         self.arguments = args
 
-        ports = get(json, ["ports"], list)
-        self.ports: List[PortConfig] = []
-        for port in ports:
-            self.ports.append(PortConfig(port))
-        logger.debug("Found %d ports", len(self.ports))
-
-        diff_pairs = get(json, ["differential_pairs"], list, [])
-        self.diff_pairs: List[DiffePairConfig] = []
-        for diff_pair in diff_pairs:
-            self.diff_pairs.append(DifferentialPairConfig(diff_pair, len(self.ports)))
-        logger.debug(f"Found {len(self.diff_pairs)} differential pairs")
+        # Ports, differential pairs and traces are only parsed once they are used
+        self._ports_json = json["ports"]
+        self._diff_pairs_json = json["differential_pairs"]
+        self._traces_json = json["traces"]
 
-        traces = get(json, ["traces"], list, [])
-        self.traces: List[TraceConfig] = []
-        for trace in traces:
-            self.traces.append(TraceConfig(trace, len(self.ports)))
-        logger.debug(f"Found {len(self.traces)} traces")
-
-        self.load_layers(get(json, ["layers"], list, []))
+        self.load_layers(json["layers"])
+        logger.removeHandler(collector)
+        self._parse_warnings = collector.records
 
         self.dirs = DirectoryConfig(args.input, args.output)
         self.material_priorities = MaterialPriorityConfig()
 
         self.__class__._instance = self
 
+    @cached_property
+    def ports(self) -> List[PortConfig]:
+        """Return port configs."""
+        ports = [PortConfig.from_config(port) for port in self._ports_json]
+        logger.debug("Found %d ports", len(ports))
+        return ports
+
+    @cached_property
+    def diff_pairs(self) -> List[DifferentialPairConfig]:
+        """Return differential pair configs."""
+        port_count = len(self.ports)
+        diff_pairs = [DifferentialPairConfig.from_config(diff_pair, port_count) for diff_pair in self._diff_pairs_json]
+        logger.debug(f"Found {len(diff_pairs)} differential pairs")
+        return diff_pairs
+
+    @cached_property
+    def traces(self) -> List[TraceConfig]:
+        """Return trace configs."""
+        port_count = len(self.ports)
+        traces = [TraceConfig.from_config(trace, port_count) for trace in self._traces_json]
+        logger.debug(f"Found {len(traces)} traces")
+        return traces
+
     def load_layers(self, layers) -> None:
-        layers = [LayerConfig(layer) for layer in layers]
-        is_sim = lambda layer: layer.kind in (LayerKind.METAL, LayerKind.SUBSTRATE)
-        layers = [layer for layer in layers if is_sim(layer)]
+        layers = [LayerConfig.from_config(layer) for layer in layers]
+        substrate, metal = LayerKind.SUBSTRATE, LayerKind.METAL
         # NOTE: If our metal layer has thickness we extend the height of the surrounding dielectric layers so the height of the stackup is correct
-        total_layers = len(layers)
-        for index in range(total_layers):
-            layer = layers[index] 
-            prev_layer = layers[index-1] if index > 1 else None
-            next_layer = layers[index+1] if index < (total_layers-1) else None
-            if layer.thickness > 0 and layer.kind == LayerKind.METAL:
+        last_index = len(layers) - 1
+        for index, layer in enumerate(layers):
+            if layer.thickness > 0 and layer.kind is metal:
                 delta = layer.thickness / 2
-                if prev_layer and prev_layer.kind == LayerKind.SUBSTRATE:
-                    prev_layer.thickness += delta
-                if next_layer and next_layer.kind == LayerKind.SUBSTRATE:
-                    next_layer.thickness += delta
+                if index > 0 and layers[index-1].kind is substrate:
+                    layers[index-1].thickness += delta
+                if index < last_index and layers[index+1].kind is substrate:
+                    layers[index+1].thickness += delta
         self.layers = layers
+        self._substrates = [layer for layer in layers if layer.kind is substrate]
+        self._metals = [layer for layer in layers if layer.kind is metal]
 
     def get_substrates(self) -> List[LayerConfig]:
         """Return substrate layers configs."""
-        return list(filter(lambda layer: layer.kind == LayerKind.SUBSTRATE, self.layers))
+        return self._substrates
 
     def get_metals(self) -> List[LayerConfig]:
         """Return metals layers configs."""
-        return list(filter(lambda layer: layer.kind == LayerKind.METAL, self.layers))
+        return self._metals
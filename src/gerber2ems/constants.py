@@ -10,3 +10,4 @@ VIA_POLYGON = 8
 
 STACKUP_FORMAT_VERSION = "1.0"
 CONFIG_FORMAT_VERSION = "1.1"
+CONFIG_FORMAT_VERSION_PARTS = tuple(int(part) for part in CONFIG_FORMAT_VERSION.split("."))
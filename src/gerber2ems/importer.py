@@ -16,6 +16,7 @@ import matplotlib.pyplot as plt
 import multiprocessing
 
 from gerber2ems.config import Config
+from gerber2ems.workers import create_pool
 from gerber2ems.constants import (
     UNIT,
     PIXEL_SIZE_MICRONS,
@@ -24,6 +25,14 @@ from gerber2ems.constants import (
 
 logger = logging.getLogger(__name__)
 
+# Excellon drill file records (in mm)
+DRILL_SIZE_REGEX = re.compile(r"^T([0-9]+)C([0-9]+\.[0-9]+)$", re.MULTILINE)
+DRILL_SWITCH_REGEX = re.compile(r"^T([0-9]+)$", re.MULTILINE)
+DRILL_HOLE_REGEX = re.compile(r"^X(-?[0-9]+\.[0-9]+)Y(-?[0-9]+\.[0-9]+)$", re.MULTILINE)
+
+# Total pixel count of layer images above which they are triangulated in worker processes
+PARALLEL_TRIANGULATION_MIN_PIXELS = 20_000_000
+
 def process_gbrs_to_pngs():
     """Process all gerber files to PNG's.
 
@@ -53,8 +62,17 @@ def process_gbrs_to_pngs():
             os.path.join(config.dirs.image_dir, output),
         ])
 
-    with multiprocessing.Pool() as pool:
-        pool.starmap(gbr_to_png, args)
+    if len(args) == 0:
+        return
+
+    with multiprocessing.Pool(processes=min(len(args), os.cpu_count() or 1)) as pool:
+        for output_filename in pool.imap_unordered(_gbr_to_png_from_args, args):
+            logger.debug("Finished generating PNG %s.png", output_filename)
+
+def _gbr_to_png_from_args(args: List[str]) -> str:
+    """Unpack arguments for gbr_to_png when used with Pool.imap_unordered."""
+    gbr_to_png(*args)
+    return args[-1]
 
 def gbr_to_png(gerber_filename: str, edge_filename: str, output_filename: str) -> None:
     """Generate PNG from gerber file.
@@ -71,25 +89,31 @@ def gbr_to_png(gerber_filename: str, edge_filename: str, output_filename: str) -
     if not dpi.is_integer():
         logger.warning("DPI is not an integer number: %f", dpi)
 
-    gerbv_command = " ".join([
-         "gerbv",
-        f"{gerber_filename} {edge_filename}",
+    gerbv_command = [
+        "gerbv",
+        gerber_filename,
+        edge_filename,
         f"--output={not_cropped_name}",
-        f"--dpi={dpi} --export=png --antialias --border=0",
-         "--background=#000000 --foreground=#ffffffff --foreground=#0000ff",
-    ])
-
-    subprocess.call(gerbv_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True)
+        f"--dpi={int(dpi)}",
+        "--export=png",
+        "--antialias",
+        "--border=0",
+        "--background=#000000",
+        "--foreground=#ffffffff",
+        "--foreground=#0000ff",
+    ]
 
-    not_cropped_image = PIL.Image.open(not_cropped_name)
+    subprocess.run(gerbv_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
 
-    # image_width, image_height = not_cropped_image.size
-    bbox = not_cropped_image.getbbox()
+    # Uncropped image is released as soon as it is cropped so only one full size image is held at a time
+    with PIL.Image.open(not_cropped_name) as not_cropped_image:
+        # image_width, image_height = not_cropped_image.size
+        bbox = not_cropped_image.getbbox()
 
-    # TODO: Figure out how to calculate cropped offset correctly so that
-    #       config.x_offset and config.y_offset don't need to be specified manually
-    # logger.warning(f"Gerber cropped: name='{gerber_filename}', specified_offset=({config.x_offset},{config.y_offset}), crop_bbox={bbox}")
-    cropped_image = not_cropped_image.crop(bbox)
+        # TODO: Figure out how to calculate cropped offset correctly so that
+        #       config.x_offset and config.y_offset don't need to be specified manually
+        # logger.warning(f"Gerber cropped: name='{gerber_filename}', specified_offset=({config.x_offset},{config.y_offset}), crop_bbox={bbox}")
+        cropped_image = not_cropped_image.crop(bbox)
     cropped_image.save(f"{output_filename}.png")
     # if not Config.get().arguments.debug:
     #     os.remove(not_cropped_name)
@@ -102,14 +126,33 @@ def get_dimensions(input_filename: str) -> Tuple[int, int]:
     """
     config = Config.get()
     path = os.path.join(config.dirs.image_dir, input_filename)
-    image = PIL.Image.open(path)
-    image_width, image_height = image.size
+    # Opening only reads the header and the file is closed right away
+    with PIL.Image.open(path) as image:
+        image_width, image_height = image.size
     height = image_height * PIXEL_SIZE_MICRONS
     width = image_width * PIXEL_SIZE_MICRONS
     logger.debug("Board dimensions read from file are: height:%f width:%f", height, width)
     return (width, height)
 
 
+def get_layers_triangles(input_filenames: List[str]) -> List[np.ndarray]:
+    """Triangulate multiple layer images, in parallel when they are big enough.
+
+    Returns a list of triangles for each image in the same order as given filenames.
+    """
+    config = Config.get()
+    processes = min(len(input_filenames), os.cpu_count() or 1)
+    pixels = 0
+    for filename in input_filenames:
+        with PIL.Image.open(os.path.join(config.dirs.image_dir, filename)) as image:
+            pixels += image.width * image.height
+    # Spawned workers import the whole package before doing any work so it only pays off for big images
+    if processes <= 1 or pixels < PARALLEL_TRIANGULATION_MIN_PIXELS:
+        return [get_triangles(filename) for filename in input_filenames]
+
+    with create_pool(processes) as pool:
+        return pool.map(get_triangles, input_filenames)
+
 def get_triangles(input_filename: str) -> np.ndarray:
     """Triangulate image.
 
@@ -121,10 +164,9 @@ def get_triangles(input_filename: str) -> np.ndarray:
     config = Config.get()
     nanomesh_config = config.nanomesh
     path = os.path.join(config.dirs.image_dir, input_filename)
-    image = PIL.Image.open(path)
-    image_grayscale = image.convert("L")
-    image_binarized = image_grayscale.point(lambda p: 255 if p < nanomesh_config.threshold else 0)
-    image_data = np.array(image_binarized)
+    with PIL.Image.open(path) as image:
+        image_grayscale = np.asarray(image.convert("L"))
+    image_data = np.where(image_grayscale < nanomesh_config.threshold, np.uint8(255), np.uint8(0))
     copper = Image(image_data)
 
     mesher = Mesher2D(copper)
@@ -137,7 +179,6 @@ def get_triangles(input_filename: str) -> np.ndarray:
         precision=int(nanomesh_config.precision/PIXEL_SIZE_MICRONS),
         group_regions=False
     )
-    mesher.plot_contour()
     # https://rufat.be/triangle/API.html#triangle.triangulate
     triangulation_options = [
         "q", nanomesh_config.minimum_angle,
@@ -145,18 +186,20 @@ def get_triangles(input_filename: str) -> np.ndarray:
     ]
     mesh = mesher.triangulate(opts="".join(map(str, triangulation_options)))
 
-    filename = os.path.join(config.dirs.geometry_dir, input_filename.removeprefix(".png") + "_mesh.png")
-    logger.debug("Saving mesh to file: %s", filename)
-    mesh.plot_mpl(lw=0.1)
-    plt.savefig(filename, dpi=600)
+    # Rendering the mesh takes much longer than triangulating it so only do it when debugging
+    if config.arguments.debug:
+        filename = os.path.join(config.dirs.geometry_dir, input_filename.removeprefix(".png") + "_mesh.png")
+        logger.debug("Saving mesh to file: %s", filename)
+        mesher.plot_contour()
+        mesh.plot_mpl(lw=0.1)
+        plt.savefig(filename, dpi=150)
+        plt.close("all")
 
     points = mesh.get("triangle").points
     cells = mesh.get("triangle").cells
     kinds = mesh.get("triangle").cell_data["physical"]
 
-    triangles: np.ndarray = np.empty((len(cells), 3, 2))
-    for i, cell in enumerate(cells):
-        triangles[i] = [points[cell[i]]*PIXEL_SIZE_MICRONS for i in range(3)]
+    triangles: np.ndarray = points[cells].astype(np.float64, copy=False) * PIXEL_SIZE_MICRONS
 
     # Selecting only triangles that represent copper
     # mask = kinds == 2.0
@@ -168,34 +211,36 @@ def get_triangles(input_filename: str) -> np.ndarray:
         is_region_copper[region.label] = is_copper
     # mask = np.array([is_region_copper[x] for x in kinds])
     # NOTE: We need to do this ugly hack because physical cell data is somethings wrong????
-    kind_to_region_id = {}
-    unique_kinds = np.unique(kinds)
-    remaining_kinds = set(kinds)
-    remaining_region_ids = set(is_region_copper.keys())
-    for kind in unique_kinds:
-        kind = int(kind)
-        if kind in is_region_copper:
-            kind_to_region_id[kind] = kind
-            remaining_kinds.remove(kind)
-            remaining_region_ids.remove(kind)
+    unique_kinds = np.unique(kinds).astype(np.intp)
+    kind_ids = set(unique_kinds.tolist())
+    region_ids = set(is_region_copper.keys())
+    kind_to_region_id = {kind: kind for kind in kind_ids & region_ids}
+    # Sorted so that dangling kinds are paired with regions the same way on every run
+    remaining_kinds = sorted(kind_ids - region_ids)
+    remaining_region_ids = sorted(region_ids - kind_ids)
     for kind, region_id in zip(remaining_kinds, remaining_region_ids):
-        kind = int(kind)
         logger.warning(f"Applying hack to reassign dangling region kind={kind} to region_id={region_id}")
         kind_to_region_id[kind] = region_id
         logger.warning(f"Forcing hacked region to be copper")
         is_region_copper[region_id] = True
 
-    mask = np.array([is_region_copper[kind_to_region_id[int(x)]] for x in kinds])
+    # Lookup table from cell kind to whether it is copper
+    is_kind_copper = np.zeros(int(unique_kinds.max()) + 1, dtype=bool)
+    for kind, region_id in kind_to_region_id.items():
+        is_kind_copper[kind] = is_region_copper[region_id]
+    mask = is_kind_copper[kinds.astype(np.intp)]
 
-    logger.debug("Found %d triangles for %s", len(triangles[mask]), input_filename)
+    triangles = triangles[mask]
+    logger.debug("Found %d triangles for %s", len(triangles), input_filename)
 
-    return triangles[mask]
+    return triangles
 
-def get_vias() -> List[List[float]]:
+def get_vias() -> np.ndarray:
     """Get via information from excellon file.
 
     Looks for excellon file in `fab` directory. Its filename should end with `-PTH.drl`
     It then processes it to find all vias.
+    Returns an array where each row is (x, y, diameter).
     """
     config = Config.get()
     files = os.listdir(config.dirs.input_dir)
@@ -204,50 +249,34 @@ def get_vias() -> List[List[float]]:
         logger.error("Couldn't find drill file")
         sys.exit(1)
 
-    drills = {0: 0.0}  # Drills are numbered from 1. 0 is added as a "no drill" option
-    current_drill = 0
-    vias: List[List[float]] = []
-    x_offset, y_offset = Config.get().x_offset, Config.get().y_offset
     with open(os.path.join(config.dirs.input_dir, drill_filename), "r", encoding="utf-8") as drill_file:
-        for line in drill_file.readlines():
-            # Regex for finding drill sizes (in mm)
-            match = re.fullmatch("T([0-9]+)C([0-9]+.[0-9]+)\\n", line)
-            if match is not None:
-                logger.debug("Got drill size: id={0}, diameter={1} mm".format(match.group(1), match.group(2)))
-                drills[int(match.group(1))] = float(match.group(2)) / 1000 / UNIT
-                continue
-
-            # Regex for finding drill switches (in mm)
-            match = re.fullmatch("T([0-9]+)\\n", line)
-            if match is not None:
-                logger.debug("Switching to drill bit: new_id={0}, old_id={1}".format(match.group(1), current_drill))
-                current_drill = int(match.group(1))
-                continue
-
-            # Regex for finding hole positions (in mm)
-            match = re.fullmatch("X([\-]?[0-9]+\.[0-9]+)Y([\-]?[0-9]+\.[0-9]+)\\n", line)
-            if match is not None:
-                if current_drill in drills:
-                    logger.debug(
-                        f"Adding via at: X{float(match.group(1)) / 1000 / UNIT}Y{float(match.group(2)) / 1000 / UNIT}"
-                    )
-                    x_pos = float(match.group(1))
-                    y_pos = float(match.group(2))
-                    x_pos = x_pos - x_offset
-                    y_pos = y_pos - y_offset
-                    x_pos = x_pos / 1000 / UNIT
-                    y_pos = y_pos / 1000 / UNIT
-                    if x_pos < 0 or y_pos < 0:
-                        logger.warning("Drill position is possibly outside of bounds: x={0}, y={1}".format(x_pos, y_pos))
-                    vias.append(
-                        [
-                            x_pos, y_pos,
-                            drills[current_drill],
-                        ]
-                    )
-                else:
-                    logger.warning("Drill file parsing failed. Drill with specifed number wasn't found")
-                continue
+        content = drill_file.read()
+
+    drills = {0: 0.0}  # Drills are numbered from 1. 0 is added as a "no drill" option
+    for match in DRILL_SIZE_REGEX.finditer(content):
+        logger.debug("Got drill size: id={0}, diameter={1} mm".format(match.group(1), match.group(2)))
+        drills[int(match.group(1))] = float(match.group(2)) / 1000 / UNIT
+
+    # Holes are grouped into sections by drill switches: [holes, id, holes, id, holes, ...]
+    sections = DRILL_SWITCH_REGEX.split(content)
+    drill_ids = [0] + [int(drill_id) for drill_id in sections[1::2]]
+    offset = np.array([config.x_offset, config.y_offset])
+    vias: List[np.ndarray] = []
+    for drill_id, section in zip(drill_ids, sections[0::2]):
+        logger.debug("Switching to drill bit: new_id={0}".format(drill_id))
+        holes = DRILL_HOLE_REGEX.findall(section)
+        if len(holes) == 0:
+            continue
+        if drill_id not in drills:
+            logger.warning("Drill file parsing failed. Drill with specifed number wasn't found")
+            continue
+        positions = (np.array(holes, dtype=np.float64) - offset) / 1000 / UNIT
+        for x_pos, y_pos in positions[(positions < 0).any(axis=1)]:
+            logger.warning("Drill position is possibly outside of bounds: x={0}, y={1}".format(x_pos, y_pos))
+        diameters = np.full((len(positions), 1), drills[drill_id])
+        vias.append(np.hstack((positions, diameters)))
+
+    vias = np.concatenate(vias) if vias else np.empty((0, 3))
     logger.debug("Found %d vias", len(vias))
     return vias
 
@@ -263,18 +292,19 @@ def import_port_positions() -> None:
         if filename.endswith("-pos.csv"):
             ports += get_ports_from_file(os.path.join(config.dirs.input_dir, filename))
 
+    config_ports = config.ports
     for number, position, direction in ports:
-        if len(Config.get().ports) > number:
-            port = Config.get().ports[number]
+        if len(config_ports) > number:
+            port = config_ports[number]
             if port.position is None:
-                Config.get().ports[number].position = position
-                Config.get().ports[number].direction = direction
+                port.position = position
+                port.direction = direction
             else:
                 logger.warning(
                     "Port #%i is defined twice on the board. Ignoring the second instance",
                     number,
                 )
-    for index, port in enumerate(Config.get().ports):
+    for index, port in enumerate(config_ports):
         if port.position is None:
             logger.error("Port #%i is not defined on board. It will be skipped", index)
 
@@ -285,7 +315,9 @@ def get_ports_from_file(filename: str) -> List[Tuple[int, Tuple[float, float], f
     with open(filename, "r", encoding="utf-8") as csvfile:
         reader = csv.reader(csvfile, delimiter=",", quotechar='"')
         next(reader, None)  # skip the headers
-        x_offset, y_offset = Config.get().x_offset, Config.get().y_offset
+        config = Config.get()
+        x_offset, y_offset = config.x_offset, config.y_offset
+        inv_unit = 1.0 / (1000 * UNIT)
         for row in reader:
             if "Simulation_Port" in row[1]:
                 number = int(row[0][2:])
@@ -303,7 +335,7 @@ def get_ports_from_file(filename: str) -> List[Tuple[int, Tuple[float, float], f
                 ports.append(
                     (
                         number,
-                        (float(x) / 1000 / UNIT, float(y) / 1000 / UNIT),
+                        (x * inv_unit, y * inv_unit),
                         rotation,
                     )
                 )
@@ -6,7 +6,7 @@ import sys
 import json
 import argparse
 import logging
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
 import shutil
 
 import coloredlogs
@@ -15,6 +15,7 @@ import numpy as np
 from gerber2ems.simulation import Simulation
 from gerber2ems.postprocess import Postprocesor
 from gerber2ems.config import Config
+from gerber2ems.workers import create_pool
 import gerber2ems.importer as importer
 
 logger = logging.getLogger(__name__)
@@ -38,8 +39,11 @@ def main():
         logger.info('No steps selected. Exiting. To select steps use "-c", -g", "-s", "-p", "-r", "-a" flags')
         sys.exit(0)
 
-    config_json, config_filepath = open_config(args)
-    config = Config(config_json, args)
+    config_content, config_filepath = open_config(args)
+    config = Config.load_cached(config_content, args)
+    if config is None:
+        config = Config(parse_config(config_content, config_filepath), args)
+        config.save_cache(config_content)
     create_dir(config.dirs.output_dir)
  
     logger.info("Importing port locations")
@@ -58,7 +62,7 @@ def main():
     if args.simulate or args.all:
         logger.info("Running simulation")
         create_dir(config.dirs.simulation_dir, cleanup=True)
-        simulate(threads=args.threads)
+        simulate(threads=args.threads, jobs=args.jobs)
 
     if args.postprocess or args.render or args.all:
         logger.info("Postprocessing")
@@ -105,17 +109,32 @@ def geometry() -> None:
     logger.info("Saving geometry file")
     sim.save_geometry()
 
-def simulate(threads: None | int = None) -> None:
+def simulate(threads: None | int = None, jobs: int = 1) -> None:
     """Run the simulation."""
-    for index, port in enumerate(Config.get().ports):
-        if port.excite:
-            sim = Simulation()
-            sim.create_materials()
-            sim.set_excitation()
-            logging.info("Simulating with excitation on port #%i", index)
-            sim.load_geometry()
-            add_ports(sim, index)
-            sim.run(f"{index}", threads=threads)
+    config = Config.get()
+    excited = [index for index, port in enumerate(config.ports) if port.excite]
+    jobs = max(1, min(jobs, len(excited)))
+    if jobs == 1:
+        for index in excited:
+            _simulate_port(index, threads)
+        return
+
+    # Split thread budget between simultaneously running simulations
+    total_threads = threads if threads is not None else (os.cpu_count() or 1)
+    threads_per_job = max(1, total_threads // jobs)
+    logger.info("Simulating %d ports with %d jobs using %d threads each", len(excited), jobs, threads_per_job)
+    with create_pool(jobs) as pool:
+        pool.starmap(_simulate_port, [(index, threads_per_job) for index in excited])
+
+def _simulate_port(index: int, threads: None | int = None) -> None:
+    """Run the simulation with excitation on a single port."""
+    sim = Simulation()
+    sim.create_materials()
+    sim.set_excitation()
+    logging.info("Simulating with excitation on port #%i", index)
+    sim.load_geometry()
+    add_ports(sim, index)
+    sim.run(f"{index}", threads=threads)
 
 def postprocess() -> Postprocesor:
     """Postprocess data from the simulation."""
@@ -205,7 +224,15 @@ def parse_arguments() -> Any:
         action="store_true",
         help="Export electric field data from the simulation",
     )
-    parser.add_argument("-t", "--threads", dest="threads", help="Number of threads to run the simulation on")
+    parser.add_argument("-t", "--threads", dest="threads", type=int, help="Number of threads to run the simulation on")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="Number of port excitations to simulate in parallel (threads are split between them)",
+    )
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-d", "--debug", action="store_true", dest="debug")
@@ -244,27 +271,33 @@ def setup_logging(args: Any) -> None:
         disabled_logger.setLevel(logging.ERROR)
 
 
-def open_config(args: Any) -> None:
-    """Try to open and parse config as json."""
+def open_config(args: Any) -> Tuple[bytes, str]:
+    """Try to open and read config file."""
     file_name = os.path.abspath(args.config)
     if not os.path.isfile(file_name):
         logger.error("Config file doesn't exist: %s", file_name)
         sys.exit(1)
 
-    with open(file_name, "r", encoding="utf-8") as file:
-        try:
-            config = json.load(file)
-        except json.JSONDecodeError as error:
-            logger.error(f"Failed to parse config file: {file_name}")
-            logger.error(
-                "JSON decoding failed at %d:%d: %s",
-                error.lineno,
-                error.colno,
-                error.msg,
-            )
-            sys.exit(1)
-
-    return (config, file_name)
+    with open(file_name, "rb") as file:
+        content = file.read()
+
+    return (content, file_name)
+
+def parse_config(content: bytes, file_name: str) -> Any:
+    """Try to parse config as json."""
+    try:
+        config = json.loads(content.decode("utf-8"))
+    except json.JSONDecodeError as error:
+        logger.error(f"Failed to parse config file: {file_name}")
+        logger.error(
+            "JSON decoding failed at %d:%d: %s",
+            error.lineno,
+            error.colno,
+            error.msg,
+        )
+        sys.exit(1)
+
+    return config
 
 def create_dir(path: str, cleanup: bool = False) -> None:
     """Create a directory if doesn't exist."""
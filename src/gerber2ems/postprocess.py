@@ -1,11 +1,9 @@
 """Module contains functions usefull for postprocessing data."""
-from gerber2ems.config import Config
-from collections import OrderedDict
-from typing import Union
+from gerber2ems.config import Config, DifferentialPairConfig
+from typing import List, Tuple, Union
 import os
 import logging
 import numpy as np
-import pandas as pd
 
 logger = logging.getLogger(__name__)
 
@@ -31,18 +29,22 @@ class Postprocesor:
             [self.count, self.count, len(self.frequencies)], np.complex128
         )  # Reflected wave phasors table ([measured_port][excited_port][frequency])
         self.reflected[:] = np.nan
+        self._filled = np.zeros([self.count, self.count], bool)  # Which port data was supplied ([measured_port][excited_port])
         self.reference_zs = np.empty([self.count], np.complex128)
         self.reference_zs[:] = np.nan  # Reference impedances of ports
 
         self.s_params = np.empty(
-            [self.count, self.count, len(self.frequencies)], np.complex128
+            [self.count, self.count, len(self.frequencies)], np.complex64
         )  # S-parameter table ([output_port][input_port][frequency])
         self.s_params[:] = np.nan
-        self.impedances = np.empty([self.count, len(self.frequencies)], np.complex128)
+        self.impedances = np.empty([self.count, len(self.frequencies)], np.complex64)
         self.impedances[:] = np.nan
         self.delays = np.empty(
             [self.count, self.count, len(self.frequencies)], np.float64
         )  # Group delay table ([output_port][input_port][frequency])
+        self.delays[:] = np.nan
+        self.s_params_valid = np.zeros([self.count, self.count], bool)  # Which S-parameters (and delays) were calculated
+        self.impedances_valid = np.zeros([self.count], bool)  # Which impedances were calculated
         # Table of [{start_p}{stop_p}{start_n}{stop_n}] -> DifferentialParams
         self.differential_params = {}
 
@@ -57,88 +59,76 @@ class Postprocesor:
 
         Data consists of incident and reflected phasor data in relation to frequency
         """
-        if self.is_valid(self.incident[port][excited_port]):
+        if self._filled[port, excited_port]:
             logger.warning("This port data has already been supplied, overwriting")
         self.incident[port][excited_port] = incident
         self.reflected[port][excited_port] = reflected
+        self._filled[port, excited_port] = True
 
     def add_impedances(self, impedances: np.ndarray):
         """Add port reference impedances."""
-        self.reference_zs = impedances
+        self.reference_zs = np.asarray(impedances, np.complex128)
 
     def process_data(self):
         """Calculate all needed parameters for further processing. Should be called after all ports are added."""
         logger.info("Processing all data from simulation. Calculating S-parameters and impedance")
         config = Config.get()
-        for i, _ in enumerate(self.incident):
-            if self.is_valid(self.incident[i][i]):
-                for j, _ in enumerate(self.incident):
-                    if self.is_valid(self.reflected[j][i]):
-                        self.s_params[j][i] = self.reflected[j][i] / self.incident[i][i]
-
-        for i, reference_z in enumerate(self.reference_zs):
-            s_param = self.s_params[i][i]
-            if self.is_valid(reference_z) and self.is_valid(s_param):
-                self.impedances[i] = reference_z * (1 + s_param) / (1 - s_param)
-
-        for i in range(self.count):
-            if self.is_valid(self.incident[i][i]):
-                for j in range(self.count):
-                    if self.is_valid(self.s_params[j][i]):
-                        phase = np.unwrap(np.angle(self.s_params[j][i]))
-                        group_delay = -(
-                            np.convolve(phase, [1, -1], mode="valid")
-                            / np.convolve(self.frequencies, [1, -1], mode="valid")
-                            / 2
-                            / np.pi
-                        )
-                        group_delay = np.append(group_delay, group_delay[-1])
-                        self.delays[j][i] = group_delay
-
-        for index, pair in enumerate(config.diff_pairs):
-            if pair.correct:
-                self._process_diff_pair(index, pair)
-
-    def _process_diff_pair(self, index: int, pair):
+        # Incident wave of each excited port ([excited_port][frequency])
+        excited_incident = np.diagonal(self.incident).T
+        # NaN marks data of ports that weren't excited so it is expected in the arithmetic below
+        with np.errstate(invalid="ignore"):
+            s_params = self.reflected / excited_incident[None, :, :]
+        self.s_params_valid = self._filled & np.diagonal(self._filled)[None, :]
+        s_params[~self.s_params_valid] = np.nan
+        # Derived values are calculated in double precision, only stored S-parameters and impedances are single precision
+        self.s_params[:] = s_params
+
+        s_ii = np.diagonal(s_params).T
+        with np.errstate(invalid="ignore"):
+            impedances = self.reference_zs[:, None] * (1 + s_ii) / (1 - s_ii)
+        self.impedances_valid = np.diagonal(self.s_params_valid) & ~np.isnan(self.reference_zs)
+        self.impedances[self.impedances_valid] = impedances[self.impedances_valid]
+
+        # Group delay of S-parameters that weren't calculated stays NaN
+        phase = np.unwrap(np.angle(s_params), axis=-1)
+        group_delay = -np.diff(phase, axis=-1) / np.diff(self.frequencies) / 2 / np.pi
+        self.delays[:] = np.concatenate([group_delay, group_delay[..., -1:]], axis=-1)
+
+        pairs = [(index, pair) for index, pair in enumerate(config.diff_pairs) if pair.correct]
+        if pairs:
+            self._process_diff_pairs(pairs)
+
+    def _process_diff_pairs(self, pairs: List[Tuple[int, DifferentialPairConfig]]):
+        # Ports of each pair in order (start_p, start_n, stop_p, stop_n) ([pair][port])
+        ports = np.array([[pair.start_p, pair.start_n, pair.stop_p, pair.stop_n] for _, pair in pairs])
+        # S parameters between ports of each pair gathered at once ([pair][output_port][input_port][frequency])
+        s = self.s_params[ports[:, :, None], ports[:, None, :]]
         # differential S parameters
-        sdd_11 = 0.5 * (
-            self.s_params[pair.start_p][pair.start_p]
-            - self.s_params[pair.start_n][pair.start_p]
-            - self.s_params[pair.start_p][pair.start_n]
-            + self.s_params[pair.start_n][pair.start_n]
-        )
-        sdd_21 = 0.5 * (
-            self.s_params[pair.stop_p][pair.start_p]
-            - self.s_params[pair.stop_p][pair.start_n]
-            - self.s_params[pair.stop_n][pair.start_p]
-            + self.s_params[pair.stop_n][pair.start_n]
-        )
+        sdd_11 = 0.5 * (s[:, 0, 0] - s[:, 1, 0] - s[:, 0, 1] + s[:, 1, 1])
+        sdd_21 = 0.5 * (s[:, 2, 0] - s[:, 2, 1] - s[:, 3, 0] + s[:, 3, 1])
         # differential impedance
-        s11 = self.s_params[pair.start_p][pair.start_p]
-        s21 = self.s_params[pair.start_n][pair.start_p]
-        s12 = self.s_params[pair.start_p][pair.start_n]
-        s22 = self.s_params[pair.start_n][pair.start_n]
+        s11 = s[:, 0, 0]
+        s21 = s[:, 1, 0]
+        s12 = s[:, 0, 1]
+        s22 = s[:, 1, 1]
         gamma = ((2 * s11 - s21) * (1 - s22 - s12) + (1 - s11 - s21) * (1 + s22 - 2 * s12)) / (
             (2 - s21) * (1 - s22 - s12) + (1 - s11 - s21) * (1 + s22)
         )
-        if not (
-            self.reference_zs[pair.start_p]
-            == self.reference_zs[pair.start_n]
-            == self.reference_zs[pair.stop_p]
-            == self.reference_zs[pair.stop_n]
-        ):
-            logger.warning(f"Differential pair {index} might have incorrect calculated impedance since ports dont have identical impedance")
-        z0 = self.reference_zs[pair.start_p]
-        impedance = z0 * (1 + gamma) / (1 - gamma)
-        params = DifferentialParams(sdd_11, sdd_21, impedance)
-        self.differential_params[index] = params
+        reference_zs = self.reference_zs[ports]
+        is_matched = (reference_zs == reference_zs[:, :1]).all(axis=1)
+        z0 = reference_zs[:, :1]
+        impedances = z0 * (1 + gamma) / (1 - gamma)
+        for i, (index, _) in enumerate(pairs):
+            if not is_matched[i]:
+                logger.warning(f"Differential pair {index} might have incorrect calculated impedance since ports dont have identical impedance")
+            self.differential_params[index] = DifferentialParams(sdd_11[i], sdd_21[i], impedances[i])
 
     def get_impedance(self, port: int) -> Union[np.ndarray, None]:
         """Return specified port impedance."""
         if port >= self.count:
             logger.error("Port no. %d doesn't exist", port)
             return None
-        if self.is_valid(self.impedances[port]):
+        if not self.impedances_valid[port]:
             logger.error("Impedance for port %d wasn't calculated", port)
             return None
         return self.impedances[port]
@@ -151,17 +141,15 @@ class Postprocesor:
         if input_port >= self.count:
             logger.error("Port no. %d doesn't exist", output_port)
             return None
-        s_param = self.s_params[output_port][input_port]
-        if self.is_valid(s_param):
-            return s_param
+        if self.s_params_valid[output_port, input_port]:
+            return self.s_params[output_port][input_port]
         logger.error("S%d%d wasn't calculated", output_port, input_port)
         return None
 
     def save_to_file(self) -> None:
         """Save all parameters to files."""
-        for i, _ in enumerate(self.s_params):
-            if self.is_valid(self.s_params[i][i]):
-                self._save_port_to_file(i)
+        for i in np.flatnonzero(np.diagonal(self.s_params_valid)):
+            self._save_port_to_file(int(i))
         for i in self.differential_params:
             self._save_differential_pair_to_file(i)
 
@@ -176,14 +164,12 @@ class Postprocesor:
         data.extend([(f"S{i}{port_number}", s_params[i]) for i in range(s_params.shape[0])])
         data.extend([(f"D{i}{port_number} (s)", delays[i]) for i in range(delays.shape[0])])
         data.append((f"Z{port_number} (ohms)", impedances))
-        data = OrderedDict(data)
-        df = pd.DataFrame(data)
 
         config = Config.get()
         file_name = f"port_{port_number}.csv"
         file_path = os.path.join(config.dirs.results_dir, file_name)
         logger.info("Saving port no. %d parameters to file: %s", port_number, file_path)
-        df.to_csv(file_path, index=False)
+        self._write_csv(file_path, data)
 
     def _save_differential_pair_to_file(self, index: int) -> None:
         """Save differential pair data to file"""
@@ -191,20 +177,30 @@ class Postprocesor:
         pair = config.diff_pairs[index]
         params = self.differential_params[index]
  
-        data = OrderedDict([
+        data = [
             ("Frequency (Hz)", self.frequencies),
             ("S11", params.s11),
             ("S21", params.s21),
             ("Zd (ohms)", params.Z),
-        ])
-        df = pd.DataFrame(data)
+        ]
  
         file_name = f"diffpair_{index}_{pair.start_p}{pair.stop_p}{pair.start_n}{pair.stop_n}.csv"
         file_path = os.path.join(config.dirs.results_dir, file_name)
         logger.info("Saving diffpair no. %d parameters to file: %s", index, file_path)
-        df.to_csv(file_path, index=False)
+        self._write_csv(file_path, data)
 
     @staticmethod
-    def is_valid(array: np.ndarray):
-        """Check if array doesn't have any NaN's."""
-        return not np.any(np.isnan(array))
+    def _write_csv(file_path: str, data: List[Tuple[str, np.ndarray]]) -> None:
+        """Write named columns to CSV file. Complex columns are split into real and imaginary parts."""
+        names: List[str] = []
+        columns: List[np.ndarray] = []
+        for name, column in data:
+            if np.iscomplexobj(column):
+                names.extend([f"Re {name}", f"Im {name}"])
+                columns.extend([column.real, column.imag])
+            else:
+                names.append(name)
+                columns.append(column)
+        # Single precision columns only carry 9 significant digits, printing more would just show rounding noise
+        formats = ["%.9g" if column.dtype == np.float32 else "%.17g" for column in columns]
+        np.savetxt(file_path, np.column_stack(columns), fmt=formats, delimiter=",", header=",".join(names), comments="")
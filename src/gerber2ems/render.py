@@ -2,15 +2,18 @@ from gerber2ems.config import Config
 from gerber2ems.constants import PLOT_STYLE
 import logging
 import os
-import matplotlib.pyplot as plt
+import matplotlib
 import numpy as np
 import skrf
 
-logger = logging.getLogger(__name__)
+# Plots are only saved to files so interactive backends would just slow rendering down
+matplotlib.use("Agg", force=True)
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
-def is_valid(array: np.ndarray):
-    """Check if array doesn't have any NaN's."""
-    return not np.any(np.isnan(array))
+plt.style.use(PLOT_STYLE)
+
+logger = logging.getLogger(__name__)
 
 def calculate_min_max_impedance(s11_margin, z0):
     """Calculate aproximated min-max values for impedance (it assumes phase is 0)."""
@@ -19,17 +22,27 @@ def calculate_min_max_impedance(s11_margin, z0):
     impedances = z0 * (1 + reflection_coeffs) / (1 - reflection_coeffs)
     return (abs(impedances[0]), abs(impedances[1]))
 
+def _create_figure(rows=1, layout=None):
+    """Create figure reused for all plots of a kind.
+
+    It isn't registered in pyplot so it is freed as soon as rendering is done.
+    """
+    fig = Figure(layout=layout)
+    return fig, fig.subplots(rows)
+
 def render_impedance(data, include_margins=False):
     """Render all ports impedance plots to files."""
     logger.info("Rendering impedance plots")
-    plt.style.use(PLOT_STYLE)
     config = Config.get()
+    frequencies = data.frequencies / 1e9
+    fig, axs = _create_figure(2, layout="tight")
     for port, impedance in enumerate(data.impedances):
-        if is_valid(impedance):
-            fig, axs = plt.subplots(2)
-            axs[0].plot(data.frequencies / 1e9, np.abs(impedance))
+        if data.impedances_valid[port]:
+            for ax in axs:
+                ax.cla()
+            axs[0].plot(frequencies, np.abs(impedance))
             axs[1].plot(
-                data.frequencies / 1e9,
+                frequencies,
                 np.angle(impedance, deg=True),
                 linestyle="dashed",
                 color="orange",
@@ -49,22 +62,26 @@ def render_impedance(data, include_margins=False):
                 axs[0].axhline(np.real(min_z), color="red")
                 axs[0].axhline(np.real(max_z), color="red")
 
-            fig.savefig(
-                os.path.join(config.dirs.graphs_dir, f"Z_{port+1}.png"),
-                bbox_inches="tight",
-            )
+            fig.savefig(os.path.join(config.dirs.graphs_dir, f"Z_{port+1}.png"))
 
 def render_smith(data):
     """Render port reflection smithcharts to files."""
     logger.info("Rendering smith charts")
-    plt.style.use(PLOT_STYLE)
-    net = skrf.Network(frequency=data.frequencies / 1e9, s=data.s_params.transpose(2, 0, 1))
+    frequencies = data.frequencies / 1e9
+    net = skrf.Network(frequency=frequencies, s=data.s_params.transpose(2, 0, 1))
     config = Config.get()
+    fig, axes = _create_figure(layout="tight")
+    chart_vswr_margin = None
     for port in range(data.count):
-        if is_valid(data.s_params[port][port]):
-            fig, axes = plt.subplots()
+        if data.s_params_valid[port, port]:
             s11_margin = config.ports[port].dB_margin
             vswr_margin = (10 ** (s11_margin / 20) + 1) / (10 ** (s11_margin / 20) - 1)
+            # Chart is only redrawn when VSWR circle changes, skrf doesn't draw it again on axes that already have it
+            if vswr_margin != chart_vswr_margin:
+                axes.cla()
+                skrf.plotting.smith(ax=axes, draw_labels=False, draw_vswr=[vswr_margin])
+                chart_vswr_margin = vswr_margin
+            chart_line_count = len(axes.lines)
             net.plot_s_smith(
                 m=port,
                 n=port,
@@ -73,21 +90,23 @@ def render_smith(data):
                 show_legend=True,
                 draw_vswr=[vswr_margin],
             )
-            fig.savefig(
-                os.path.join(config.dirs.graphs_dir, f"S_{port+1}{port+1}_smith.png"),
-                bbox_inches="tight",
-            )
+            fig.savefig(os.path.join(config.dirs.graphs_dir, f"S_{port+1}{port+1}_smith.png"))
+            for line in axes.lines[chart_line_count:]:
+                line.remove()
+            # Next port's locus should start from the first color again as on fresh axes
+            axes.set_prop_cycle(None)
 
 def render_trace_delays(data):
     """Render all trace delay plots to files."""
     logger.info("Rendering trace delay plots")
-    plt.style.use(PLOT_STYLE)
     config = Config.get()
+    frequencies = data.frequencies / 1e9
+    fig, axes = _create_figure()
     for trace in config.traces:
-        if trace.correct and is_valid(data.delays[trace.stop][trace.start]):
-            fig, axes = plt.subplots()
+        if trace.correct and data.s_params_valid[trace.stop, trace.start]:
+            axes.cla()
             axes.plot(
-                data.frequencies / 1e9,
+                frequencies,
                 data.delays[trace.stop][trace.start] * 1e9,
                 label=f"{trace.name} delay",
             )
@@ -100,17 +119,17 @@ def render_trace_delays(data):
     for pair in config.diff_pairs:
         if (
             pair.correct
-            and is_valid(data.delays[pair.stop_p][pair.start_n])
-            and is_valid(data.delays[pair.stop_n][pair.start_p])
+            and data.s_params_valid[pair.stop_p, pair.start_n]
+            and data.s_params_valid[pair.stop_n, pair.start_p]
         ):
-            fig, axes = plt.subplots()
+            axes.cla()
             axes.plot(
-                data.frequencies / 1e9,
+                frequencies,
                 data.delays[pair.stop_p][pair.start_n] * 1e9,
                 label=f"{pair.name} n delay",
             )
             axes.plot(
-                data.frequencies / 1e9,
+                frequencies,
                 data.delays[pair.stop_n][pair.start_p] * 1e9,
                 label=f"{pair.name} p delay",
             )
@@ -124,16 +143,19 @@ def render_s_params(data):
     """Render all S parameter plots to files."""
     config = Config.get()
     logger.info("Rendering S-parameter plots")
-    plt.style.use(PLOT_STYLE)
+    frequencies = data.frequencies / 1e9
+    # All magnitudes are converted in a single pass instead of one per plotted line
+    with np.errstate(divide="ignore"):
+        s_params_db = 20 * np.log10(np.abs(data.s_params))
+    fig, axes = _create_figure()
     for i in range(data.count):
-        if is_valid(data.s_params[i][i]):
-            fig, axes = plt.subplots()
+        if data.s_params_valid[i, i]:
+            axes.cla()
             for j in range(data.count):
-                s_param = data.s_params[j][i]
-                if is_valid(s_param):
+                if data.s_params_valid[j, i]:
                     axes.plot(
-                        data.frequencies / 1e9,
-                        20 * np.log10(np.abs(s_param)),
+                        frequencies,
+                        s_params_db[j][i],
                         label="$S_{" + f"{j+1}{i+1}" + "}$",
                     )
             axes.legend()
@@ -145,28 +167,22 @@ def render_s_params(data):
 def render_diff_pair_s_params(data):
     """Render differential pair S parameter plots to files."""
     logger.info("Rendering differential pair S-parameter plots")
-    plt.style.use(PLOT_STYLE)
     config = Config.get()
+    frequencies = data.frequencies / 1e9
+    fig, axes = _create_figure()
     for index, pair in enumerate(config.diff_pairs):
         if (
             pair.correct
-            and is_valid(data.s_params[pair.start_p][pair.start_p])
-            and is_valid(data.s_params[pair.start_n][pair.start_n])
+            and data.s_params_valid[pair.start_p, pair.start_p]
+            and data.s_params_valid[pair.start_n, pair.start_n]
         ):
-            fig, axes = plt.subplots()
+            axes.cla()
             diff_params = data.differential_params[index]
-            s11 = diff_params.s11
-            s21 = diff_params.s21
-            axes.plot(
-                data.frequencies / 1e9,
-                20 * np.log10(np.abs(s11)),
-                label=pair.name + " $SDD_{11}$",
-            )
-            axes.plot(
-                data.frequencies / 1e9,
-                20 * np.log10(np.abs(s21)),
-                label=pair.name + " $SDD_{21}$",
-            )
+            # Both parameters are plotted with a single call as columns of one array
+            s_params = np.stack([diff_params.s11, diff_params.s21], axis=1)
+            s11_line, s21_line = axes.plot(frequencies, 20 * np.log10(np.abs(s_params)))
+            s11_line.set_label(pair.name + " $SDD_{11}$")
+            s21_line.set_label(pair.name + " $SDD_{21}$")
             axes.legend()
             axes.set_xlabel("Frequency, f [GHz]")
             axes.set_ylabel("Magnitude, [dB]")
@@ -176,17 +192,19 @@ def render_diff_pair_s_params(data):
 def render_diff_impedance(data):
     """Render differential pair impedance plots to files."""
     logger.info("Rendering differential pair impedance plots")
-    plt.style.use(PLOT_STYLE)
     config = Config.get()
+    frequencies = data.frequencies / 1e9
+    fig, axs = _create_figure(2, layout="tight")
     for index, params in data.differential_params.items():
         pair = config.diff_pairs[index]
         diff_params = data.differential_params[index]
         impedance = diff_params.Z
 
-        fig, axs = plt.subplots(2)
-        axs[0].plot(data.frequencies / 1e9, np.abs(impedance))
+        for ax in axs:
+            ax.cla()
+        axs[0].plot(frequencies, np.abs(impedance))
         axs[1].plot(
-            data.frequencies / 1e9,
+            frequencies,
             np.angle(impedance, deg=True),
             linestyle="dashed",
             color="orange",
@@ -198,7 +216,4 @@ def render_diff_impedance(data):
         axs[0].grid(True)
         axs[1].grid(True)
 
-        fig.savefig(
-            os.path.join(config.dirs.graphs_dir, f"Z_diff_{pair.name}.png"),
-            bbox_inches="tight",
-        )
+        fig.savefig(os.path.join(config.dirs.graphs_dir, f"Z_diff_{pair.name}.png"))
@@ -1,9 +1,10 @@
 """Module containing Simulation class used for interacting with openEMS."""
+import locale
 import logging
 import os
 import re
 import sys
-import math
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, List, Any
 
 import CSXCAD
@@ -19,6 +20,24 @@ import gerber2ems.importer as importer
 
 logger = logging.getLogger(__name__)
 
+# Numeral written with , as decimal separator by openEMS under such locales
+DECIMAL_COMMA_REGEX = re.compile(rb"([0-9]+),([0-9]+e)")
+# Size of chunks geometry file is streamed in when fixing decimal separators
+GEOMETRY_CHUNK_SIZE = 1 << 20
+
+# Vertex directions of via polygons, shared by all vias
+VIA_POLYGON_ANGLES = np.arange(VIA_POLYGON) / VIA_POLYGON * 2 * np.pi
+VIA_POLYGON_SIN = np.sin(VIA_POLYGON_ANGLES)
+VIA_POLYGON_COS = np.cos(VIA_POLYGON_ANGLES)
+
+# Supported port rotations in degrees -> (bounding box direction, cos, sin)
+PORT_DIRECTIONS = {
+    0: ("y", 1, 0),
+    90: ("x", 0, 1),
+    180: ("y", -1, 0),
+    270: ("x", 0, -1),
+}
+
 class PortBoundingBox:
     def __init__(self, start, stop, dir) -> None:
         self.start = start # (x,y,z)
@@ -33,8 +52,9 @@ class Simulation:
 
     def __init__(self) -> None:
         """Initialize simulation object."""
+        config = Config.get()
         self.csx = CSXCAD.ContinuousStructure()
-        self.fdtd = openEMS.openEMS(NrTS=Config.get().max_steps)
+        self.fdtd = openEMS.openEMS(NrTS=config.max_steps)
         self.fdtd.SetCSX(self.csx)
         self.mesh = self.csx.GetGrid()
         self.mesh.SetDeltaUnit(UNIT)
@@ -47,13 +67,23 @@ class Simulation:
         self.plane_material = self.csx.AddMetal("Plane")
         self.port_material = self.csx.AddMetal("Port")
         self.via_material = self.csx.AddMetal("Via")
-        self.via_filling_material = self.csx.AddMaterial("ViaFilling", epsilon=Config.get().via_filling_epsilon)
+        self.via_filling_material = self.csx.AddMaterial("ViaFilling", epsilon=config.via_filling_epsilon)
+
+        # Z offsets of metal layers, metal layers are embedded in dielectric so only substrates move the offset
+        self.metal_layer_offsets: List[float] = []
+        offset = 0
+        for layer in config.layers:
+            if layer.kind == LayerKind.METAL:
+                self.metal_layer_offsets.append(offset)
+            elif layer.kind == LayerKind.SUBSTRATE:
+                offset -= layer.thickness
 
     def create_materials(self) -> None:
         """Create materials required for simulation."""
-        for i, _ in enumerate(Config.get().get_metals()):
+        config = Config.get()
+        for i, _ in enumerate(config.get_metals()):
             self.metal_materials.append(self.csx.AddMetal(f"Metal_{i}"))
-        for i, layer in enumerate(Config.get().get_substrates()):
+        for i, layer in enumerate(config.get_substrates()):
             self.dielectric_materials.append(self.csx.AddMaterial(f"Substrate_{i}", epsilon=layer.epsilon))
 
     def add_mesh(self) -> None:
@@ -64,44 +94,30 @@ class Simulation:
         if pcb_width is None or pcb_height is None:
             logger.error("PCB dimensions are not set")
             sys.exit(1)
-        #### X Mesh
-        # Min-Max
-        x_lines = np.array(
-            (
-                -config.margin_xy,
-                pcb_width + config.margin_xy,
-            )
-        )
-        # PCB
         mesh = config.pcb_mesh_xy
-        x_lines = np.concatenate(
-            (
-                x_lines,
-                np.arange(0 - mesh / 2, pcb_width + mesh / 2, step=mesh),
-            )
-        )
-        x_lines = np.round(x_lines)
+        #### X Mesh
+        # Min-Max and PCB lines written straight into one buffer
+        pcb_x_lines = np.arange(0 - mesh / 2, pcb_width + mesh / 2, step=mesh)
+        x_lines = np.empty(len(pcb_x_lines) + 2)
+        x_lines[0] = -config.margin_xy
+        x_lines[1] = pcb_width + config.margin_xy
+        x_lines[2:] = pcb_x_lines
+        np.round(x_lines, out=x_lines)
+        # Rounding can make lines coincide, duplicates would only add work for CSXCAD
+        x_lines = np.unique(x_lines)
         self.mesh.AddLine("x", x_lines)
         # Margin
         self.mesh.SmoothMeshLines("x", config.margin_mesh_xy, ratio=config.smoothing_ratio)
 
         #### Y Mesh
-        # Min-Max
-        y_lines = np.array(
-            (
-                -config.margin_xy,
-                pcb_height + config.margin_xy,
-            )
-        )
-        # PCB
-        mesh = config.pcb_mesh_xy
-        y_lines = np.concatenate(
-            [
-                y_lines,
-                np.arange(0 - mesh / 2, pcb_height + mesh / 2, step=mesh),
-            ]
-        )
-        y_lines = np.round(y_lines)
+        # Min-Max and PCB lines written straight into one buffer
+        pcb_y_lines = np.arange(0 - mesh / 2, pcb_height + mesh / 2, step=mesh)
+        y_lines = np.empty(len(pcb_y_lines) + 2)
+        y_lines[0] = -config.margin_xy
+        y_lines[1] = pcb_height + config.margin_xy
+        y_lines[2:] = pcb_y_lines
+        np.round(y_lines, out=y_lines)
+        y_lines = np.unique(y_lines)
         self.mesh.AddLine("y", y_lines)
         # Margin
         self.mesh.SmoothMeshLines("y", config.margin_mesh_xy, ratio=config.smoothing_ratio)
@@ -109,7 +125,8 @@ class Simulation:
         #### Z Mesh
         # Min-0-Max
 
-        z_lines = np.array([])
+        # Z lines of every layer are collected and joined once at the end
+        z_line_groups: List[np.ndarray] = []
         offset = 0
         z_count = int(config.inter_copper_layers)
         make_even = lambda x: x if x % 2 == 0 else x + 1
@@ -128,18 +145,16 @@ class Simulation:
                     z_line_count = make_odd(z_line_count)
                 else:
                     z_line_count = make_even(z_line_count)
-            z_lines = np.concatenate(
-                (
-                    z_lines,
-                    np.linspace(z_offset - layer.thickness, z_offset, z_line_count, endpoint=z_line_endpoint),
-                    # np.linspace(z_offset - layer.thickness, z_offset, z_line_count, endpoint=z_line_endpoint),
-                )
+            z_line_groups.append(
+                np.linspace(z_offset - layer.thickness, z_offset, z_line_count, endpoint=z_line_endpoint)
             )
             # Metal layers are embedded into the dielectric so we don't consider their z height
             if layer.kind == LayerKind.SUBSTRATE:
                 offset -= layer.thickness
-        z_lines = np.concatenate([z_lines, [config.margin_z, 0, offset, offset - config.margin_z]])
-        z_lines = np.round(z_lines)
+        z_line_groups.append(np.array([config.margin_z, 0, offset, offset - config.margin_z]))
+        z_lines = np.concatenate(z_line_groups)
+        # Adjacent layers share their boundary lines
+        z_lines = np.unique(np.round(z_lines))
         self.mesh.AddLine("z", z_lines)
         # Margin
         self.mesh.SmoothMeshLines("z", config.margin_mesh_z, ratio=config.smoothing_ratio)
@@ -166,17 +181,21 @@ class Simulation:
         logger.info("Adding layers")
         config = Config.get()
 
+        # Layers are independent so all layer images are triangulated at once
+        layer_files = [layer.file + ".png" for layer in config.layers if layer.file is not None]
+        layer_triangles = iter(importer.get_layers_triangles(layer_files))
+
+        # Materials were created in layer order so they are consumed alongside the layers
+        metal_materials = iter(self.metal_materials)
+        dielectric_materials = iter(self.dielectric_materials)
         z_offset = 0
-        metal_index = 0
-        substrate_index = 0
         for index, layer in enumerate(config.layers):
             z_start = z_offset
-            z_end = z_offset - layer.thickness
 
             if layer.kind == LayerKind.METAL:
-                material = self.metal_materials[metal_index]
+                material = next(metal_materials)
             else:
-                material = self.dielectric_materials[substrate_index]
+                material = next(dielectric_materials)
 
             layer_kind = "metal" if layer.kind == LayerKind.METAL else "dielectric"
             logger.info(
@@ -187,16 +206,12 @@ class Simulation:
             if layer.file is None:
                 self._add_plane(z_start, material, layer.thickness, layer.priority)
             else:
-                contours = importer.get_triangles(layer.file + ".png")
+                contours = next(layer_triangles)
                 self._add_contours(contours, z_start, material, layer.thickness, layer.priority)
 
+            # Metal layers are embedded into dielectric so they don't affect z-height
             if layer.kind == LayerKind.SUBSTRATE:
                 z_offset -= layer.thickness
-                substrate_index += 1
-            elif layer.kind == LayerKind.METAL:
-                # Metal layers are embedded into dielectric so they don't affect z-height
-                metal_index += 1
-
 
     def _add_plane(self, z_height: float, material, thickness: float, priority: int) -> None:
         config = Config.get()
@@ -212,32 +227,27 @@ class Simulation:
 
     def _add_contours(self, contours: np.ndarray, z_height: float, material, thickness: float, priority: int) -> None:
         """Add contours as flat polygons on specified z-height."""
-        config = Config.get()
-        for contour in contours:
-            points: List[List[float]] = [[], []]
-            for point in contour:
-                # Half of the border thickness is subtracted as image is shifted by it
-                points[0].append(round(point[1]))
-                points[1].append(round(config.pcb_height - point[0]))
-            if thickness > 0.0:
-                material.AddLinPoly(points, "z", round(z_height+thickness/2), -round(thickness), priority=priority)
-            else:
-                material.AddPolygon(points, "z", round(z_height), priority=priority)
+        pcb_height = Config.get().pcb_height
+        contours = np.asarray(contours)
+        # Image rows and columns are converted to board coordinates for all contours at once
+        xs = np.round(contours[..., 1])
+        ys = np.round(pcb_height - contours[..., 0])
+        if thickness > 0.0:
+            elevation = round(z_height + thickness / 2)
+            length = -round(thickness)
+            for x_coords, y_coords in zip(xs, ys):
+                material.AddLinPoly([x_coords, y_coords], "z", elevation, length, priority=priority)
+        else:
+            elevation = round(z_height)
+            for x_coords, y_coords in zip(xs, ys):
+                material.AddPolygon([x_coords, y_coords], "z", elevation, priority=priority)
 
     def get_metal_layer_offset(self, index: int) -> float:
         """Get z offset of nth metal layer."""
-        current_metal_index = -1
-        offset = 0
-        config = Config.get()
-        for layer in config.layers:
-            if layer.kind == LayerKind.METAL:
-                current_metal_index += 1
-                if current_metal_index == index:
-                    return offset
-            elif layer.kind == LayerKind.SUBSTRATE:
-                offset -= layer.thickness
-        logger.error("Hadn't found %dth metal layer", index)
-        sys.exit(1)
+        if not 0 <= index < len(self.metal_layer_offsets):
+            logger.error("Hadn't found %dth metal layer", index)
+            sys.exit(1)
+        return self.metal_layer_offsets[index]
 
     def _get_port_bbox(self, port_config: PortConfig) -> PortBoundingBox:
         if port_config.position is None or port_config.direction is None:
@@ -246,8 +256,8 @@ class Simulation:
         while port_config.direction < 0:
             port_config.direction += 360
 
-        dir_map = {0: "y", 90: "x", 180: "y", 270: "x"}
-        if int(port_config.direction) not in dir_map:
+        direction = int(port_config.direction)
+        if direction not in PORT_DIRECTIONS:
             raise Exception(f"Ports rotation ({port_config.direction}) is not a multiple of 90 degrees which is not supported")
 
         config = Config.get()
@@ -276,9 +286,9 @@ class Simulation:
         size_y = port_config.length
 
         # rotate bounding box around port position
-        angle = port_config.direction*math.pi/180
-        rot_x = 0.5*(size_x*math.cos(angle) - size_y*math.sin(angle))
-        rot_y = 0.5*(size_x*math.sin(angle) + size_y*math.cos(angle))
+        bbox_dir, cos, sin = PORT_DIRECTIONS[direction]
+        rot_x = 0.5*(size_x*cos - size_y*sin)
+        rot_y = 0.5*(size_x*sin + size_y*cos)
 
         bbox_start = [
             round(pos_x - rot_x),
@@ -290,7 +300,6 @@ class Simulation:
             round(pos_y + rot_y),
             round(stop_z),
         ]
-        bbox_dir = dir_map[int(port_config.direction)]
         return PortBoundingBox(bbox_start, bbox_stop, bbox_dir)
 
     def add_msl_port(self, port_config: PortConfig, port_number: int, excite: bool = False):
@@ -311,10 +320,8 @@ class Simulation:
             excite=1 if excite else 0,
         )
         self.ports.append(port)
-        self.mesh.AddLine("x", port_bbox.start[0])
-        self.mesh.AddLine("x", port_bbox.stop[0])
-        self.mesh.AddLine("y", port_bbox.start[1])
-        self.mesh.AddLine("y", port_bbox.stop[1])
+        self.mesh.AddLine("x", [port_bbox.start[0], port_bbox.stop[0]])
+        self.mesh.AddLine("y", [port_bbox.start[1], port_bbox.stop[1]])
 
     def add_resistive_port(self, port_config: PortConfig, excite: bool = False):
         """Add resistive port based on config."""
@@ -334,13 +341,11 @@ class Simulation:
         self.ports.append(port)
 
         if port_bbox.dir == "y":
-            self.mesh.AddLine("x", port_bbox.start[0])
-            self.mesh.AddLine("x", port_bbox.stop[0])
+            self.mesh.AddLine("x", [port_bbox.start[0], port_bbox.stop[0]])
             self.mesh.AddLine("y", port_bbox.start[1])
         else:
             self.mesh.AddLine("x", port_bbox.start[0])
-            self.mesh.AddLine("y", port_bbox.start[1])
-            self.mesh.AddLine("y", port_bbox.stop[1])
+            self.mesh.AddLine("y", [port_bbox.start[1], port_bbox.stop[1]])
 
     def add_virtual_port(self, port_config: PortConfig, port_number: int) -> None:
         """Add virtual port for extracting sim data from files. Needed due to OpenEMS api desing."""
@@ -359,60 +364,52 @@ class Simulation:
             excite=0,
         )
         self.ports.append(port)
-        self.mesh.AddLine("x", port_bbox.start[0])
-        self.mesh.AddLine("x", port_bbox.stop[0])
-        self.mesh.AddLine("y", port_bbox.start[1])
-        self.mesh.AddLine("y", port_bbox.stop[1])
-        self.mesh.AddLine("z", port_bbox.start[2])
-        self.mesh.AddLine("z", port_bbox.stop[2])
+        self.mesh.AddLine("x", [port_bbox.start[0], port_bbox.stop[0]])
+        self.mesh.AddLine("y", [port_bbox.start[1], port_bbox.stop[1]])
+        self.mesh.AddLine("z", [port_bbox.start[2], port_bbox.stop[2]])
 
     def add_vias(self):
         """Add all vias from excellon file."""
         logger.info("Adding vias from excellon file")
-        vias = importer.get_vias()
-        for via in vias:
-            self.add_via(via[0], via[1], via[2])
-
-    def add_via(self, x_pos, y_pos, diameter):
-        """Add via at specified position with specified diameter."""
         config = Config.get()
+        vias = importer.get_vias()
         thickness = sum(layer.thickness for layer in config.get_substrates())
-
-        x_coords = []
-        y_coords = []
-        for i in range(VIA_POLYGON):
-            x_coords.append(round(x_pos + np.sin(i / VIA_POLYGON * 2 * np.pi) * diameter / 2))
-            y_coords.append(round(y_pos + np.cos(i / VIA_POLYGON * 2 * np.pi) * diameter / 2))
-        self.via_filling_material.AddLinPoly([x_coords, y_coords], "z", -thickness, thickness, priority=config.material_priorities.via_filling)
-
-        x_coords = []
-        y_coords = []
-        for i in range(VIA_POLYGON)[::-1]:
-            x_coords.append(round(x_pos + np.sin(i / VIA_POLYGON * 2 * np.pi) * (diameter / 2 + config.via_plating)))
-            y_coords.append(round(y_pos + np.cos(i / VIA_POLYGON * 2 * np.pi) * (diameter / 2 + config.via_plating)))
-        self.via_material.AddLinPoly([x_coords, y_coords], "z", round(-thickness), round(thickness), priority=config.material_priorities.via_metal)
+        filling_priority = config.material_priorities.via_filling
+        metal_priority = config.material_priorities.via_metal
+
+        # Polygons of all vias are built at once ([via][vertex])
+        x_pos = vias[:, 0:1]
+        y_pos = vias[:, 1:2]
+        radius = vias[:, 2:3] / 2
+        filling_xs = np.round(x_pos + VIA_POLYGON_SIN * radius)
+        filling_ys = np.round(y_pos + VIA_POLYGON_COS * radius)
+        # Plating vertices go in the opposite direction
+        plating_xs = np.round(x_pos + VIA_POLYGON_SIN[::-1] * (radius + config.via_plating))
+        plating_ys = np.round(y_pos + VIA_POLYGON_COS[::-1] * (radius + config.via_plating))
+
+        for i in range(len(vias)):
+            self.via_filling_material.AddLinPoly([filling_xs[i], filling_ys[i]], "z", -thickness, thickness, priority=filling_priority)
+            self.via_material.AddLinPoly([plating_xs[i], plating_ys[i]], "z", round(-thickness), round(thickness), priority=metal_priority)
 
     def add_dump_boxes(self):
         """Add electric field measurement plane in the middle of each metal and substrate layer"""
-        offset = 0
         config = Config.get()
+        if not any(layer.export_field for layer in config.layers):
+            logger.warning("No layer has field export enabled, skipping dump boxes")
+            return
+
+        # Dump boxes only differ in height
+        start_x = start_y = round(-config.margin_xy)
+        stop_x = round(config.pcb_width + config.margin_xy)
+        stop_y = round(config.pcb_height + config.margin_xy)
+        offset = 0
         for i, layer in enumerate(config.layers):
             if layer.export_field:
                 height = offset - layer.thickness/2
                 layer_kind = "metal" if layer.kind == LayerKind.METAL else "substrate"
                 logger.info("Adding dump box at i=%d, name=%s, z=%f, thickness=%s, kind=%s", i, layer.name, height, layer.thickness, layer_kind)
                 dump = self.csx.AddDump(f"e_field_{i}", sub_sampling=[1, 1, 1])
-                start = [
-                    round(-config.margin_xy),
-                    round(-config.margin_xy),
-                    round(height),
-                ]
-                stop = [
-                    round(config.pcb_width + config.margin_xy),
-                    round(config.pcb_height + config.margin_xy),
-                    round(height),
-                ]
-                dump.AddBox(start, stop)
+                dump.AddBox([start_x, start_y, round(height)], [stop_x, stop_y, round(height)])
             # Metal layers are embedded in dielectric
             if layer.kind == LayerKind.SUBSTRATE:
                 offset -= layer.thickness
@@ -468,15 +465,36 @@ class Simulation:
         config = Config.get()
         filename = os.path.join(config.dirs.geometry_dir, "geometry.xml")
         logger.info("Saving geometry to %s", filename)
-        self.csx.Write2XML(filename)
-
-        # Replacing , with . for numerals in the file
+        # CSXCAD formats numbers according to the current locale so "C" locale is forced while writing
         # (openEMS bug mitigation for locale that uses , as decimal separator)
-        with open(filename, "r") as f:
-            content = f.read()
-        new_content = re.sub(r"([0-9]+),([0-9]+e)", r"\g<1>.\g<2>", content)
-        with open(filename, "w") as f:
-            f.write(new_content)
+        numeric_locale = locale.setlocale(locale.LC_NUMERIC)
+        decimal_point = locale.localeconv()["decimal_point"]
+        locale.setlocale(locale.LC_NUMERIC, "C")
+        try:
+            self.csx.Write2XML(filename)
+        finally:
+            locale.setlocale(locale.LC_NUMERIC, numeric_locale)
+
+        # Naming a C++ global locale also sets the C one, so with . decimal point there is nothing to fix
+        if decimal_point == ".":
+            return
+        # Replacing , with . for numerals in the file in case CSXCAD formatted them with a C++ locale
+        self._fix_decimal_commas(filename)
+
+    @staticmethod
+    def _fix_decimal_commas(filename: str) -> None:
+        """Replace , decimal separators in file numerals with . streaming it through a temporary file."""
+        temp_filename = filename + ".tmp"
+        with open(filename, "rb") as source, open(temp_filename, "wb") as target:
+            tail = b""
+            for chunk in iter(lambda: source.read(GEOMETRY_CHUNK_SIZE), b""):
+                chunk = tail + chunk
+                # Trailing digits and commas may be part of a numeral continued in the next chunk
+                split = len(chunk.rstrip(b"0123456789,"))
+                target.write(DECIMAL_COMMA_REGEX.sub(rb"\1.\2", chunk[:split]))
+                tail = chunk[split:]
+            target.write(tail)
+        os.replace(temp_filename, filename)
 
     def load_geometry(self) -> None:
         """Load geometry from file."""
@@ -493,17 +511,20 @@ class Simulation:
         config = Config.get()
         result_path = os.path.join(config.dirs.simulation_dir, f"{index}")
 
-        incident: List[np.ndarray] = []
-        reflected: List[np.ndarray] = []
-        for index, port in enumerate(self.ports):
-            try:
-                logger.debug("Calculating port parameters %d (%s)", index, result_path)
-                port.CalcPort(result_path, frequencies)
-                logger.debug("Found data for port %d", index)
-            except IOError:
-                logger.error("Port data files do not exist. Did you run simulation step?")
-                sys.exit(1)
-            incident.append(port.uf_inc)
-            reflected.append(port.uf_ref)
+        def calc_port(port_index: int, port) -> None:
+            logger.debug("Calculating port parameters %d (%s)", port_index, result_path)
+            port.CalcPort(result_path, frequencies)
+            logger.debug("Found data for port %d", port_index)
+
+        # Ports are independent and mostly wait on reading probe files so they are calculated concurrently
+        workers = max(1, min(len(self.ports), os.cpu_count() or 1))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(calc_port, range(len(self.ports)), self.ports))
+        except IOError:
+            logger.error("Port data files do not exist. Did you run simulation step?")
+            sys.exit(1)
 
+        incident: List[np.ndarray] = [port.uf_inc for port in self.ports]
+        reflected: List[np.ndarray] = [port.uf_ref for port in self.ports]
         return (reflected, incident)
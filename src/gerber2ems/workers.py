@@ -0,0 +1,22 @@
+"""Module containing helpers for running work in worker processes."""
+import multiprocessing
+import multiprocessing.pool
+
+from gerber2ems.config import Config
+
+
+def create_pool(processes: int) -> multiprocessing.pool.Pool:
+    """Create pool of worker processes with config and logging set up.
+
+    openEMS and CSXCAD state can't be safely forked so workers are always spawned.
+    """
+    context = multiprocessing.get_context("spawn")
+    return context.Pool(processes, initializer=init_worker, initargs=(Config.get(),))
+
+def init_worker(config: Config) -> None:
+    """Make config and logging available in spawned worker process."""
+    # Imported here since main imports modules that use this one
+    from gerber2ems.main import setup_logging
+
+    Config.set(config)
+    setup_logging(config.arguments)